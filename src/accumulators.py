@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import abc
+import io
+import math
+
+import numpy as np
+
+
+# Online accumulators for per-tree metrics. Each one is updated with numpy
+# arrays of values a chunk at a time, uses memory independent of the number
+# of values seen, can be merged with another accumulator of the same
+# configuration (e.g. one per worker), and round-trips through to_bytes() /
+# from_bytes().
+
+
+class Accumulator(abc.ABC):
+    # Subclasses provide arrays() / from_arrays() and get compact npz
+    # serialization from here.
+    @abc.abstractmethod
+    def arrays(self) -> dict:
+        ...
+
+    @classmethod
+    @abc.abstractmethod
+    def from_arrays(cls, arrays):
+        ...
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        np.savez_compressed(buf, **self.arrays())
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls.from_arrays(dict(arrays))
+
+
+class Histogram(Accumulator):
+    # Fixed bins over [lo, hi]. Values outside the range are only counted,
+    # since the bins have to agree for histograms to be mergeable.
+    def __init__(self, lo: float, hi: float, bins: int = 100):
+        self.edges = np.linspace(lo, hi, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    def update(self, values) -> Histogram:
+        values = np.asarray(values, dtype=float)
+        counts, _ = np.histogram(values, bins=self.edges)
+        self.counts += counts
+        self.underflow += int(np.count_nonzero(values < self.edges[0]))
+        self.overflow += int(np.count_nonzero(values > self.edges[-1]))
+        return self
+
+    def merge(self, other: Histogram) -> Histogram:
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("cannot merge histograms with different bins")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def total(self) -> int:
+        return int(self.counts.sum()) + self.underflow + self.overflow
+
+    def arrays(self) -> dict:
+        return {"edges": self.edges, "counts": self.counts,
+                "outside": np.array([self.underflow, self.overflow])}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> Histogram:
+        hist = cls(0, 1, 1)
+        hist.edges = arrays["edges"]
+        hist.counts = arrays["counts"]
+        hist.underflow, hist.overflow = (int(x) for x in arrays["outside"])
+        return hist
+
+
+class IntegerHistogram(Accumulator):
+    # Unit bins over the non-negative integers, grown to fit the largest
+    # value seen, so it is exact and merges without agreeing on a range up
+    # front. Suited to integer metrics with a modest maximum, like term sizes.
+    def __init__(self):
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def _add(self, counts: np.ndarray) -> IntegerHistogram:
+        if len(counts) > len(self.counts):
+            self.counts = np.pad(self.counts, (0, len(counts) - len(self.counts)))
+        self.counts[:len(counts)] += counts
+        return self
+
+    def update(self, values) -> IntegerHistogram:
+        values = np.asarray(values, dtype=np.int64)
+        if values.size and values.min() < 0:
+            raise ValueError("integer histograms only count non-negative values")
+        return self._add(np.bincount(values))
+
+    def merge(self, other: IntegerHistogram) -> IntegerHistogram:
+        return self._add(other.counts)
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> int | None:
+        # Same rank convention as QuantileSketch.quantile, but exact. None
+        # when nothing has been counted.
+        n = self.total()
+        if n == 0:
+            return None
+        return int(np.searchsorted(np.cumsum(self.counts), q * (n - 1), side="right"))
+
+    def arrays(self) -> dict:
+        return {"counts": self.counts}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> IntegerHistogram:
+        hist = cls()
+        hist.counts = arrays["counts"]
+        return hist
+
+
+class Moments(Accumulator):
+    # Count, mean, variance, min and max. Chunks are combined with Chan et
+    # al.'s pairwise update, so merging is exact up to rounding.
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _combine(self, n, mean, m2, lo, hi) -> Moments:
+        if n == 0:
+            return self
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.min = min(self.min, lo)
+        self.max = max(self.max, hi)
+        return self
+
+    def update(self, values) -> Moments:
+        values = np.asarray(values, dtype=float)
+        if values.size == 0:
+            return self
+        mean = values.mean()
+        m2 = float(((values - mean) ** 2).sum())
+        return self._combine(values.size, float(mean), m2, values.min(), values.max())
+
+    def merge(self, other: Moments) -> Moments:
+        return self._combine(other.n, other.mean, other.m2, other.min, other.max)
+
+    def variance(self) -> float:
+        return self.m2 / self.n if self.n else 0.0
+
+    def std(self) -> float:
+        return math.sqrt(self.variance())
+
+    def arrays(self) -> dict:
+        return {"n": np.array(self.n),
+                "stats": np.array([self.mean, self.m2, self.min, self.max])}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> Moments:
+        moments = cls()
+        moments.n = int(arrays["n"])
+        moments.mean, moments.m2, moments.min, moments.max = (float(x) for x in arrays["stats"])
+        return moments
+
+
+class QuantileSketch(Accumulator):
+    # DDSketch: values are counted in logarithmic buckets of relative width
+    # `alpha`, so every quantile is returned within relative error alpha, and
+    # the number of buckets only grows with the log of the range of values.
+    def __init__(self, alpha: float = 0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.positive: dict[int, int] = {}
+        self.negative: dict[int, int] = {}
+        self.zeros = 0
+
+    def _add(self, store: dict[int, int], magnitudes: np.ndarray):
+        keys = np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def update(self, values) -> QuantileSketch:
+        values = np.asarray(values, dtype=float)
+        self._add(self.positive, values[values > 0])
+        self._add(self.negative, -values[values < 0])
+        self.zeros += int(np.count_nonzero(values == 0))
+        return self
+
+    def merge(self, other: QuantileSketch) -> QuantileSketch:
+        if self.alpha != other.alpha:
+            raise ValueError("cannot merge sketches with different accuracy")
+        for store, other_store in ((self.positive, other.positive),
+                                   (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zeros += other.zeros
+        return self
+
+    def count(self) -> int:
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zeros
+
+    def _value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q: float) -> float:
+        n = self.count()
+        if n == 0:
+            return math.nan
+        rank = q * (n - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return math.nan
+
+    def arrays(self) -> dict:
+        def store_array(store):
+            return np.array(list(store.items()), dtype=np.int64).reshape(-1, 2)
+
+        return {"alpha": np.array(self.alpha), "zeros": np.array(self.zeros),
+                "positive": store_array(self.positive),
+                "negative": store_array(self.negative)}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> QuantileSketch:
+        sketch = cls(float(arrays["alpha"]))
+        sketch.zeros = int(arrays["zeros"])
+        sketch.positive = {key: count for key, count in arrays["positive"].tolist()}
+        sketch.negative = {key: count for key, count in arrays["negative"].tolist()}
+        return sketch
+
+
+class MetricAccumulator(Accumulator):
+    # A histogram, moments and a quantile sketch of the same metric.
+    def __init__(self, lo: float, hi: float, bins: int = 100, alpha: float = 0.01):
+        self.histogram = Histogram(lo, hi, bins)
+        self.moments = Moments()
+        self.sketch = QuantileSketch(alpha)
+
+    def update(self, values) -> MetricAccumulator:
+        values = np.asarray(values, dtype=float)
+        self.histogram.update(values)
+        self.moments.update(values)
+        self.sketch.update(values)
+        return self
+
+    def merge(self, other: MetricAccumulator) -> MetricAccumulator:
+        self.histogram.merge(other.histogram)
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def arrays(self) -> dict:
+        arrays = {}
+        for name in ("histogram", "moments", "sketch"):
+            for key, value in getattr(self, name).arrays().items():
+                arrays[f"{name}.{key}"] = value
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays) -> MetricAccumulator:
+        def part(name):
+            prefix = f"{name}."
+            return {key[len(prefix):]: arrays[key] for key in arrays if key.startswith(prefix)}
+
+        acc = cls(0, 1, 1)
+        acc.histogram = Histogram.from_arrays(part("histogram"))
+        acc.moments = Moments.from_arrays(part("moments"))
+        acc.sketch = QuantileSketch.from_arrays(part("sketch"))
+        return acc
+
+
+def accumulate(values, acc, chunk_size=4096):
+    # Feeds an iterable of scalars to `acc` in chunks of `chunk_size`.
+    chunk = np.empty(chunk_size)
+    n = 0
+    for value in values:
+        chunk[n] = value
+        n += 1
+        if n == chunk_size:
+            acc.update(chunk)
+            n = 0
+    if n:
+        acc.update(chunk[:n])
+    return acc
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import bisect
+import random
+import re
+
+from btree_generator import BtreeGen, Standardization
+from lambda_ast import ASTNode
+
+
+# BtreeGen turns a binary search tree with n nodes into a term with n nodes:
+# nodes with two children become applications, nodes with one child become
+# abstractions (left-only and right-only give the same term) and leaves become
+# variables. So the terms it can produce are exactly the unary-binary trees
+# with n nodes, labelled as in BtreeGen.annotate_tree: an abstraction under d
+# other abstractions binds x{d}, and a leaf under d abstractions is one of the
+# max_free_vars + 1 free variables or one of x0..x{d-1}.
+#
+# Terms of a given size are ordered leaves first (free variables, then bound
+# ones), then abstractions, then applications by size of the left subterm,
+# then by left subterm, then by right subterm.
+#
+# With std=Standardization.NONE (the default) count, rank and unrank describe
+# exactly the terms iter_terms and random_tree yield. Other standardizations
+# are not injective: under PREFIX, a (size 1) and \x0.a (size 2) both become
+# \a.\x0.a, so the output is then neither distinct nor uniform over distinct
+# standardized terms.
+
+
+class BtreeEnum:
+    def __init__(self, max_free_vars=6, std=Standardization.NONE):
+        self.max_free_vars = max_free_vars
+        self.gen = BtreeGen(max_free_vars=max_free_vars, std=std)
+        self._counts = {}
+        self._app_offsets = {}
+
+    def n_leaf_labels(self, depth: int) -> int:
+        return self.max_free_vars + 1 + depth
+
+    def count(self, n: int, depth: int = 0) -> int:
+        # Number of terms with n nodes whose root sits under `depth`
+        # abstractions.
+        key = (n, depth)
+        if key not in self._counts:
+            if n < 1:
+                self._counts[key] = 0
+            elif n == 1:
+                self._counts[key] = self.n_leaf_labels(depth)
+            else:
+                offsets = self.app_offsets(n, depth)
+                self._counts[key] = self.count(n - 1, depth + 1) + offsets[-1]
+        return self._counts[key]
+
+    def app_offsets(self, n: int, depth: int) -> list[int]:
+        # offsets[k - 1] is the number of applications with n nodes whose left
+        # subterm has fewer than k nodes.
+        key = (n, depth)
+        if key not in self._app_offsets:
+            offsets = [0]
+            for k in range(1, n - 1):
+                offsets.append(offsets[-1] + self.count(k, depth) * self.count(n - 1 - k, depth))
+            self._app_offsets[key] = offsets
+        return self._app_offsets[key]
+
+    def count_up_to(self, n: int) -> int:
+        return sum(self.count(k) for k in range(1, n + 1))
+
+    def unrank(self, n: int, index: int, depth: int = 0) -> ASTNode:
+        # Returns the term before standardization, so that rank inverts it;
+        # iter_terms and random_tree standardize.
+        if not 0 <= index < self.count(n, depth):
+            raise IndexError(f"no term of size {n} with index {index}")
+        if n == 1:
+            if index <= self.max_free_vars:
+                return ASTNode(None, None).set_value(chr(97 + index))
+            return ASTNode(None, None).set_value(f"x{index - self.max_free_vars - 1}")
+
+        n_abs = self.count(n - 1, depth + 1)
+        if index < n_abs:
+            body = self.unrank(n - 1, index, depth + 1)
+            return ASTNode(body, None).set_value(f"x{depth}")
+
+        index -= n_abs
+        offsets = self.app_offsets(n, depth)
+        k = bisect.bisect_right(offsets, index)
+        index -= offsets[k - 1]
+        left_index, right_index = divmod(index, self.count(n - 1 - k, depth))
+        left = self.unrank(k, left_index, depth)
+        right = self.unrank(n - 1 - k, right_index, depth)
+        return ASTNode(left, right)
+
+    def rank(self, tree: ASTNode) -> int:
+        # Inverse of unrank, i.e. takes terms before standardization. Raises
+        # ValueError for any term unrank cannot produce, which includes
+        # PREFIX or POSTFIX standardized terms.
+        index, _ = self.rank_sized(tree, 0)
+        return index
+
+    def leaf_index(self, name: str, depth: int) -> int:
+        if bound := re.fullmatch(r"x(\d+)", name):
+            index = self.max_free_vars + 1 + int(bound[1])
+        elif re.fullmatch(r"[a-z]", name) and ord(name) - 97 <= self.max_free_vars:
+            index = ord(name) - 97
+        else:
+            index = -1
+        if not 0 <= index < self.n_leaf_labels(depth):
+            raise ValueError(f"variable {name} cannot occur under {depth} abstractions")
+        return index
+
+    def rank_sized(self, tree: ASTNode, depth: int) -> tuple[int, int]:
+        # Returns (rank, size) so that no subterm is counted twice.
+        match tree.left, tree.right:
+            case (None, None):
+                return self.leaf_index(tree.value, depth), 1
+            case (None, body) | (body, None):
+                if tree.value != f"x{depth}":
+                    raise ValueError(f"abstraction under {depth} abstractions must bind x{depth}, not {tree.value}")
+                index, k = self.rank_sized(body, depth + 1)
+                return index, k + 1
+            case (left, right):
+                left_index, k = self.rank_sized(left, depth)
+                right_index, m = self.rank_sized(right, depth)
+                n = k + m + 1
+                index = self.count(n - 1, depth + 1) \
+                    + self.app_offsets(n, depth)[k - 1] \
+                    + left_index * self.count(m, depth) \
+                    + right_index
+                return index, n
+
+    def iter_terms(self, n: int, start=0, stop=None):
+        # Terms of size n with index in [start, stop), so enumeration can be
+        # split across workers by index range.
+        stop = self.count(n) if stop is None else min(stop, self.count(n))
+        for index in range(start, stop):
+            yield self.gen.standardize(self.unrank(n, index))
+
+    def iter_terms_up_to(self, n: int):
+        for k in range(1, n + 1):
+            yield from self.iter_terms(k)
+
+    def random_tree(self, n: int) -> ASTNode:
+        # Uniform over all terms of size n, unlike BtreeGen.random_tree.
+        return self.gen.standardize(self.unrank(n, random.randrange(self.count(n))))
+
+
+def main():
+    enum = BtreeEnum(max_free_vars=1)
+    for n in range(1, 6):
+        print(n, enum.count(n))
+    for tree in enum.iter_terms_up_to(3):
+        print(tree.tolambda())
+
+
+if __name__ == '__main__':
+    main()
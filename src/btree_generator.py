@@ -9,7 +9,7 @@ import re
 
 from enum import Enum
 
-from lambda_ast import ASTNode
+from lambda_ast import ASTNode, NodeType
 
 import utils
 
@@ -78,6 +78,71 @@ class PermutationTree:
         return f"({left}{',' if left and right else ''}{right})"
 
 
+class PermutationShapes:
+    # A batch of the binary search trees built by inserting keys 0..n-1 in
+    # increasing order of `priorities`, stored as (batch, n) index arrays
+    # rather than PermutationTree nodes. Node k holds key k, and missing
+    # children are -1. The root is its own parent.
+    def __init__(self, priorities: np.ndarray):
+        self.priorities = priorities
+        batch, n = priorities.shape
+        keys = np.arange(n)
+
+        # The parent of k is whichever of its nearest already-inserted
+        # neighbours in key order was inserted last.
+        pred = self.nearest_earlier(priorities)
+        succ = n - 1 - self.nearest_earlier(priorities[:, ::-1])[:, ::-1]
+        pred_p = np.take_along_axis(priorities, np.maximum(pred, 0), axis=1)
+        succ_p = np.take_along_axis(priorities, np.minimum(succ, n - 1), axis=1)
+        use_pred = (pred >= 0) & ((succ >= n) | (pred_p > succ_p))
+        self.parent = np.where(use_pred, pred, np.where(succ < n, succ, keys))
+        self.root = np.argmin(priorities, axis=1)
+
+        rows, nodes = np.nonzero(self.parent != keys)
+        parents = self.parent[rows, nodes]
+        is_left = nodes < parents
+        self.left = np.full((batch, n), -1)
+        self.right = np.full((batch, n), -1)
+        self.left[rows[is_left], parents[is_left]] = nodes[is_left]
+        self.right[rows[~is_left], parents[~is_left]] = nodes[~is_left]
+        self.depth = self.annotate_depths()
+
+    @staticmethod
+    def nearest_earlier(priorities: np.ndarray) -> np.ndarray:
+        # For every k, the largest key below k with a smaller priority, or -1.
+        # This is the all-nearest-smaller-values scan, which follows the
+        # chain of earlier answers and so is O(n) per tree; it runs over keys
+        # in lockstep across the batch, keeping memory at O(batch * n).
+        batch, n = priorities.shape
+        pred = np.full((batch, n), -1)
+        for k in range(1, n):
+            p = np.full(batch, k - 1)
+            rows = np.nonzero(priorities[:, k - 1] > priorities[:, k])[0]
+            while rows.size:
+                p[rows] = pred[rows, p[rows]]
+                rows = rows[p[rows] >= 0]
+                rows = rows[priorities[rows, p[rows]] > priorities[rows, k]]
+            pred[:, k] = p
+        return pred
+
+    def n_children(self) -> np.ndarray:
+        return (self.left >= 0).astype(int) + (self.right >= 0)
+
+    def annotate_depths(self) -> np.ndarray:
+        # Same depths as PermutationTree.annotate_depths: the number of
+        # one-child ancestors. Each node starts with the increment from its
+        # parent, and pointer jumping sums the increments along every root
+        # path in log2(n) vectorized steps.
+        unary = self.n_children() == 1
+        depth = np.take_along_axis(unary, self.parent, axis=1).astype(int)
+        depth[np.arange(len(depth)), self.root] = 0
+        ancestor = self.parent
+        for _ in range(int(np.ceil(np.log2(max(depth.shape[1], 2))))):
+            depth = depth + np.take_along_axis(depth, ancestor, axis=1)
+            ancestor = np.take_along_axis(ancestor, ancestor, axis=1)
+        return depth
+
+
 class BtreeGen:
     def __init__(self, freevar_p=0.2, max_free_vars=6, n_nodes=20, std=Standardization.PREFIX):
         self.max_free_vars = max_free_vars
@@ -115,14 +180,18 @@ class BtreeGen:
         return tree
 
     def prefix_standardize(self, tree: ASTNode) -> ASTNode:
+        freevars = [tree.search_for_value(chr(97 + i))
+                    for i in range(self.max_free_vars + 1)]
+        return self.prefix_wrap(tree, tree.must_have_free_variables(), freevars)
+
+    def prefix_wrap(self, tree: ASTNode, must_have_free_variables, freevars) -> ASTNode:
         node = tree
-        if tree.must_have_free_variables():
+        if must_have_free_variables:
             node = ASTNode(node, None).set_value(r"x0")
             pass
-        for i in range(self.max_free_vars + 1):
-            freevar_value = chr(97 + i)
-            if tree.search_for_value(freevar_value):
-                node = ASTNode(node, None).set_value(freevar_value)
+        for i, present in enumerate(freevars):
+            if present:
+                node = ASTNode(node, None).set_value(chr(97 + i))
         return node
 
     def standardize(self, tree: ASTNode) -> ASTNode:
@@ -132,7 +201,7 @@ class BtreeGen:
             case Standardization.POSTFIX:
                 return self.postfix_standardize(tree)
             case Standardization.NONE:
-                return None
+                return tree
 
     def random_lambda(self):
         random_tree = self.random_tree()
@@ -159,7 +228,72 @@ class BtreeGen:
                 left = self.annotate_tree(tree.left)
                 return ASTNode(left, right)
 
+    def annotate_shapes(self, shapes: PermutationShapes,
+                        coins: np.ndarray, choices: np.ndarray):
+        # Vectorized annotate_tree over a batch. `coins` and `choices` are
+        # (batch, n) uniforms in [0, 1), one per node, of which only the
+        # leaves' are used. Returns (batch, n) arrays of NodeType values and
+        # labels: the bound index of an abstraction or bound variable, or the
+        # free variable index (0 is 'a').
+        n_children = shapes.n_children()
+        depth = shapes.depth
+        free = (coins < self.freevar_p) | (depth == 0)
+        leaf_kind = np.where(free, NodeType.FreeVariable.value, NodeType.BoundVariable.value)
+        leaf_label = np.where(free,
+                              (choices * (self.max_free_vars + 1)).astype(int),
+                              (choices * depth).astype(int))
+        kind = np.choose(n_children, [leaf_kind,
+                                      NodeType.Abstraction.value,
+                                      NodeType.Application.value])
+        label = np.where(n_children == 0, leaf_label, depth)
+        return kind, label
+
+    def shapes_to_asts(self, shapes: PermutationShapes, kind: np.ndarray, label: np.ndarray):
+        # Children are always inserted after their parents, so building in
+        # reverse insertion order needs no recursion.
+        free, bound = NodeType.FreeVariable.value, NodeType.BoundVariable.value
+        abstraction = NodeType.Abstraction.value
+        orders = np.argsort(shapes.priorities, axis=1)[:, ::-1]
+        for b, order in enumerate(orders.tolist()):
+            kinds, labels = kind[b].tolist(), label[b].tolist()
+            lefts, rights = shapes.left[b].tolist(), shapes.right[b].tolist()
+            nodes = [None] * len(order)
+            for k in order:
+                if kinds[k] == free:
+                    nodes[k] = ASTNode(None, None).set_value(chr(97 + labels[k]))
+                elif kinds[k] == bound:
+                    nodes[k] = ASTNode(None, None).set_value(f"x{labels[k]}")
+                elif kinds[k] == abstraction:
+                    body = nodes[max(lefts[k], rights[k])]
+                    nodes[k] = ASTNode(body, None).set_value(f"x{labels[k]}")
+                else:
+                    nodes[k] = ASTNode(nodes[lefts[k]], nodes[rights[k]])
+            yield nodes[order[-1]]
+
+    def trees_from_draws(self, draws: np.ndarray):
+        # `draws` is (batch, 3, n_nodes): insertion priorities, leaf coins and
+        # variable choices.
+        shapes = PermutationShapes(draws[:, 0, :])
+        kind, label = self.annotate_shapes(shapes, draws[:, 1, :], draws[:, 2, :])
+        trees = self.shapes_to_asts(shapes, kind, label)
+        if self.std != Standardization.PREFIX:
+            yield from (self.standardize(tree) for tree in trees)
+            return
+
+        # prefix_standardize's tree walks, answered from the arrays: a free
+        # leaf under no abstraction forces the x0 wrapper, and every free
+        # variable that occurs gets bound.
+        leaf = (kind == NodeType.FreeVariable.value) | (kind == NodeType.BoundVariable.value)
+        must_have_free = (leaf & (shapes.depth == 0)).any(axis=1)
+        is_free = kind == NodeType.FreeVariable.value
+        freevars = (is_free[:, :, None]
+                    & (label[:, :, None] == np.arange(self.max_free_vars + 1))).any(axis=1)
+        for tree, must, present in zip(trees, must_have_free.tolist(), freevars.tolist()):
+            yield self.prefix_wrap(tree, must, present)
+
     def random_tree(self):
+        # A single tree is cheaper to build recursively than through a batch
+        # of one; iter_trees is the batched path.
         permutation = np.random.permutation(self.n_nodes)
         tree = PermutationTree()
         for i in permutation:
@@ -169,6 +303,44 @@ class BtreeGen:
         tree = self.standardize(tree)
         return tree
 
+    def draws_per_tree(self) -> int:
+        # Every tree consumes exactly this many uniforms: a row each of
+        # insertion priorities, leaf coins and variable choices. The fixed
+        # budget is what lets iter_trees skip ahead without building skipped
+        # trees.
+        return 3 * self.n_nodes
+
+    def iter_draws(self, start=0, stop=None, seed=None, chunk_size=1024):
+        if seed is None:
+            seed = random.getrandbits(64)
+        rng = np.random.default_rng(seed)
+        rng.bit_generator.advance(start * self.draws_per_tree())
+
+        i = start
+        while stop is None or i < stop:
+            n = chunk_size if stop is None else min(chunk_size, stop - i)
+            yield rng.random((n, 3, self.n_nodes))
+            i += n
+
+    def iter_arrays(self, start=0, stop=None, seed=None, chunk_size=1024):
+        # Same stream as iter_trees, as (shapes, kind, label) batches of
+        # unstandardized trees for consumers that never need an ASTNode.
+        for draws in self.iter_draws(start, stop, seed, chunk_size):
+            shapes = PermutationShapes(draws[:, 0, :])
+            yield (shapes, *self.annotate_shapes(shapes, draws[:, 1, :], draws[:, 2, :]))
+
+    def iter_trees(self, start=0, stop=None, seed=None, chunk_size=1024):
+        """Lazily yields trees start, start + 1, ..., stop - 1 of the stream
+        for `seed`, drawing the randomness for `chunk_size` trees at a time.
+        Tree i depends only on `seed` and i, so streams can be split across
+        workers by index range."""
+        for draws in self.iter_draws(start, stop, seed, chunk_size):
+            yield from self.trees_from_draws(draws)
+
+    def iter_lambdas(self, start=0, stop=None, seed=None, chunk_size=1024):
+        for tree in self.iter_trees(start, stop, seed, chunk_size):
+            yield tree.tolambda()
+
 
 def main():
     gen = BtreeGen(n_nodes=40, std=Standardization.PREFIX)
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import argparse
+import collections
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from btree_generator import BtreeGen, Standardization
+from fontana_generator import FontanaGen
+from accumulators import IntegerHistogram, Moments
+from corpus_index import IndexWriter, term_keys
+
+import utils
+
+
+# Usage, from src/:
+#   python cli.py btree --count 1000000 --n-nodes 40 --closed --dedup -o out.txt
+#   python cli.py fontana --count 1000 --max-depth 12 --format alchemy --stats
+#
+# Terms are produced in fixed-size chunks. Each chunk skips ahead to its own
+# index range of the generator's stream for --seed, so output is identical for
+# any worker count, and at most a few chunks are in flight at once, so memory
+# does not grow with --count.
+
+
+def make_gen(args):
+    match args.generator:
+        case "btree":
+            return BtreeGen(freevar_p=args.freevar_p,
+                            max_free_vars=args.max_free_vars,
+                            n_nodes=args.n_nodes,
+                            std=Standardization[args.std.upper()])
+        case "fontana":
+            return FontanaGen(max_depth=args.max_depth,
+                              max_nvars=args.max_nvars,
+                              application_prange=tuple(args.application_prange),
+                              abstraction_prange=tuple(args.abstraction_prange))
+
+
+def generate(gen, start, stop, seed):
+    return gen.iter_trees(start, stop, seed)
+
+
+def filter_terms(trees, min_size=0, max_size=None, closed=False):
+    # Yields (tree, size, is_closed), so later stages need not walk the tree
+    # again for either.
+    for tree in trees:
+        size = tree.n_nodes()
+        if size < min_size or (max_size is not None and size > max_size):
+            continue
+        is_closed = tree.is_closed()
+        if closed and not is_closed:
+            continue
+        yield tree, size, is_closed
+
+
+def serialize(terms, fmt, index=False):
+    # Yields (dedup key, payload, size, is_closed, index keys) records.
+    for tree, size, is_closed in terms:
+        s = tree.tolambda()
+        match fmt:
+            case "text":
+                payload = s + "\n"
+            case "alchemy":
+                payload = utils.to_alchemy(s) + "\n"
+            case "binary":
+                payload = utils.encode_binary(tree)
+        keys = term_keys(tree) if index else None
+        yield s, payload, size, is_closed, keys
+
+
+def process_chunk(args, chunk, n):
+    start = chunk * args.chunk_size
+    trees = generate(make_gen(args), start, start + n, args.seed)
+    terms = filter_terms(trees, args.min_size, args.max_size, args.closed)
+    return list(serialize(terms, args.format, args.index))
+
+
+def chunks(args):
+    for chunk, start in enumerate(range(0, args.count, args.chunk_size)):
+        yield chunk, min(args.chunk_size, args.count - start)
+
+
+def run_chunks(args):
+    if args.workers <= 1:
+        for chunk, n in chunks(args):
+            yield process_chunk(args, chunk, n)
+        return
+
+    # Pool.imap would queue every chunk up front, so keep a bounded window of
+    # pending results instead.
+    with multiprocessing.Pool(args.workers) as pool:
+        pending = collections.deque()
+        for chunk, n in chunks(args):
+            pending.append(pool.apply_async(process_chunk, (args, chunk, n)))
+            if len(pending) >= 2 * args.workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def dedup(records, window):
+    # Remember the digests of the last `window` distinct terms.
+    seen = collections.OrderedDict()
+    for record in records:
+        digest = hashlib.blake2b(record[0].encode(), digest_size=16).digest()
+        if digest in seen:
+            seen.move_to_end(digest)
+            continue
+        seen[digest] = None
+        if len(seen) > window:
+            seen.popitem(last=False)
+        yield record
+
+
+class CorpusStats:
+    def __init__(self):
+        self.n_closed = 0
+        self.moments = Moments()
+        self.sizes = IntegerHistogram()
+
+    def update(self, sizes, closed):
+        self.moments.update(sizes)
+        self.sizes.update(sizes)
+        self.n_closed += int(np.count_nonzero(closed))
+
+    def report(self, generated: int) -> str:
+        moments = self.moments
+        if moments.n:
+            lo, mean, hi = int(moments.min), moments.mean, int(moments.max)
+        else:
+            lo, mean, hi = None, 0, None
+        quantiles = "/".join(str(self.sizes.quantile(q)) for q in (0.5, 0.9, 0.99))
+        return "\n".join([
+            f"generated: {generated}",
+            f"written: {moments.n}",
+            f"closed: {self.n_closed}",
+            f"size min/mean/max: {lo}/{mean:.3f}/{hi}",
+            f"size std: {moments.std():.3f}",
+            f"size p50/p90/p99: {quantiles}",
+        ])
+
+
+def open_output(path, fmt):
+    binary = fmt == "binary"
+    if path == "-":
+        return sys.stdout.buffer if binary else sys.stdout, False
+    return open(path, "wb" if binary else "w", buffering=1 << 20), True
+
+
+def write_records(out, records, buffer_size, binary):
+    # Yields each buffer of records once it has been written.
+    buffer = []
+    for record in records:
+        buffer.append(record)
+        if len(buffer) >= buffer_size:
+            out.write((b"" if binary else "").join(r[1] for r in buffer))
+            yield buffer
+            buffer = []
+    if buffer:
+        out.write((b"" if binary else "").join(r[1] for r in buffer))
+        yield buffer
+
+
+def run(args):
+    records = (record for chunk in run_chunks(args) for record in chunk)
+    if args.dedup:
+        records = dedup(records, args.dedup_window)
+
+    binary = args.format == "binary"
+    out, close = open_output(args.output, args.format)
+    index = None
+    if args.index:
+        index = IndexWriter(args.output + ".idx", args.format)
+    elif args.output != "-" and os.path.isdir(args.output + ".idx"):
+        # An index left from an earlier corpus at this path would be stale.
+        shutil.rmtree(args.output + ".idx")
+    stats = CorpusStats()
+    corpus_size = None
+    try:
+        if binary:
+            header = utils.BINARY_MAGIC
+        elif args.format == "alchemy":
+            header = "1\n\n"
+        else:
+            header = ""
+        out.write(header)
+        offset = len(header)
+        term_id = 0
+        for buffer in write_records(out, records, args.buffer_size, binary):
+            stats.update([r[2] for r in buffer], [r[3] for r in buffer])
+            if index is not None:
+                # Payloads are ascii, so their length is their size in bytes.
+                for _, payload, _, _, keys in buffer:
+                    index.add(term_id, offset, keys)
+                    offset += len(payload)
+                    term_id += 1
+        corpus_size = offset
+    finally:
+        if close:
+            out.close()
+        else:
+            out.flush()
+        if index is not None:
+            index.close(corpus_size)
+
+    if args.stats:
+        print(stats.report(args.count), file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate corpora of random lambda expressions.")
+    sub = parser.add_subparsers(dest="generator", required=True)
+
+    btree = sub.add_parser("btree", help="random binary search tree generator")
+    btree.add_argument("--n-nodes", type=int, default=20)
+    btree.add_argument("--freevar-p", type=float, default=0.2)
+    btree.add_argument("--max-free-vars", type=int, default=6)
+    btree.add_argument("--std", choices=["prefix", "postfix", "none"], default="prefix",
+                       help="standardization applied to each generated tree")
+
+    fontana = sub.add_parser("fontana", help="Fontana's generator")
+    fontana.add_argument("--max-depth", type=int, default=10)
+    fontana.add_argument("--max-nvars", type=int, default=6)
+    fontana.add_argument("--application-prange", type=float, nargs=2, default=[0.3, 0.5])
+    fontana.add_argument("--abstraction-prange", type=float, nargs=2, default=[0.5, 0.3])
+
+    for p in (btree, fontana):
+        p.add_argument("-n", "--count", type=int, default=1000,
+                       help="number of terms to generate, before filtering")
+        p.add_argument("--seed", type=int, default=314159)
+        p.add_argument("-j", "--workers", type=int, default=1)
+        p.add_argument("--chunk-size", type=int, default=1000)
+        p.add_argument("--min-size", type=int, default=0, help="minimum number of nodes")
+        p.add_argument("--max-size", type=int, default=None, help="maximum number of nodes")
+        p.add_argument("--closed", action="store_true", help="drop terms with free variables")
+        p.add_argument("--dedup", action="store_true", help="drop repeated terms")
+        p.add_argument("--dedup-window", type=int, default=1000000,
+                       help="number of recent distinct terms remembered by --dedup")
+        p.add_argument("-f", "--format", choices=["text", "alchemy", "binary"], default="text")
+        p.add_argument("-o", "--output", default="-")
+        p.add_argument("--buffer-size", type=int, default=4096,
+                       help="number of terms buffered per write")
+        p.add_argument("--stats", action="store_true", help="print corpus statistics to stderr")
+        p.add_argument("--index", action="store_true",
+                       help="write a subterm and variable index to OUTPUT.idx, see corpus_index.py")
+
+    args = parser.parse_args(argv)
+    if args.index and args.output == "-":
+        parser.error("--index needs --output")
+    for name in ("chunk_size", "workers", "buffer_size", "dedup_window"):
+        if getattr(args, name) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    if args.generator == "fontana" and not 0 <= args.max_nvars <= 25:
+        parser.error("--max-nvars must be between 0 and 25")
+    return args
+
+
+def main(argv=None):
+    try:
+        run(parse_args(argv))
+    except BrokenPipeError:
+        # The reader went away, e.g. `| head`. Point stdout at devnull so the
+        # interpreter's final flush does not raise again.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,9 @@ from fontana_generator import FontanaGen
 
 from lambda_parse import LambdaLexer, LambdaParser
 from lambda_ast import ASTNode
+from accumulators import MetricAccumulator, accumulate
 
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 
@@ -30,35 +32,47 @@ def r_app_abs(tree):
     return n_app / n_abs
 
 
-def plot(fn):
+def metric_distribution(gen, fn, value_range, n=10000):
+    acc = MetricAccumulator(*value_range, bins=100)
+    return accumulate((fn(tree) for tree in gen.iter_trees(stop=n)), acc)
+
+
+def plot_distribution(ax, acc, **kwargs):
+    # Values outside the fixed range are drawn as one extra bin at whichever
+    # end they fell off, rather than silently left out.
+    hist = acc.histogram
+    counts, edges = hist.counts, hist.edges
+    width = edges[1] - edges[0]
+    if hist.underflow:
+        counts = np.concatenate(([hist.underflow], counts))
+        edges = np.concatenate(([edges[0] - width], edges))
+    if hist.overflow:
+        counts = np.concatenate((counts, [hist.overflow]))
+        edges = np.concatenate((edges, [edges[-1] + width]))
+    ax.stairs(counts, edges, fill=True, **kwargs)
+
+
+def plot(fn, value_range):
     print(fn.__name__)
     fig, axs = plt.subplots(2, 1, sharex=True, tight_layout=True)
     cmap = mpl.colormaps['viridis']
 
     for i in range(30, 2, -1):
-        data = []
-        gen = FontanaGen(max_depth=i)
-        for j in range(10000):
-            tree = gen.random_tree()
-            adeg = fn(tree)
-            data.append(adeg)
-        axs[0].hist(data, alpha=0.5, bins=100, label=i, color=cmap(i / 30))
+        acc = metric_distribution(FontanaGen(max_depth=i), fn, value_range)
+        plot_distribution(axs[0], acc, alpha=0.5, label=i, color=cmap(i / 30))
 
     for i in range(2, 50):
-        data = []
-        gen = BtreeGen(n_nodes=i)
-        for j in range(10000):
-            tree = gen.random_tree()
-            adeg = fn(tree)
-            data.append(adeg)
-        axs[1].hist(data, alpha=0.5, bins=100, label=i, color=cmap(i / 50))
+        acc = metric_distribution(BtreeGen(n_nodes=i), fn, value_range)
+        plot_distribution(axs[1], acc, alpha=0.5, label=i, color=cmap(i / 50))
 
     plt.savefig(f'./img/{fn.__name__}.png')
 
 
 def main():
-    plot(average_degree)
-    plot(r_app_abs)
+    # Histograms need fixed bins to stay mergeable; values outside the range
+    # land in an overflow bin.
+    plot(average_degree, (0, 2))
+    plot(r_app_abs, (0, 20))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,326 @@
+from __future__ import annotations
+
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from lambda_ast import ASTNode, NodeType
+from lambda_parse import LambdaLexer, LambdaParser
+
+import utils
+
+
+# An inverted index over a corpus written by cli.py, kept in `<corpus>.idx/`.
+# Every term is indexed under 64-bit hashes of:
+#   free:<name>     each free variable of the term
+#   var:<name>      each variable name occurring in the term
+#   sub:<canon>     each subterm, up to renaming of the binders inside it
+#   pattern:<canon> each subterm, with the variables it does not bind erased,
+#                   i.e. its binder pattern
+#
+# Postings are written in segments of at most `run_size` (key, term id)
+# pairs, so building the index at write time takes bounded memory. Each
+# segment stores sorted unique keys, CSR offsets and term ids as .npy files,
+# which are memory-mapped on query, so a lookup is a binary search per
+# segment.
+
+
+def key_hash(kind: str, payload: str) -> int:
+    digest = hashlib.blake2b(f"{kind}:{payload}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+# Subterm keys hash each subterm as its preorder token sequence: one token
+# for an application, one for an abstraction and one per variable, where a
+# variable bound inside the subterm is its de Bruijn index and any other
+# variable keeps its name (or becomes "_" in a pattern). That sequence is the
+# subterm's canonical form, so matching is up to renaming of the binders
+# inside it. The hash is a polynomial in HASH_BASE over the tokens, weighted
+# by their preorder position in the whole term. A subterm is a contiguous
+# preorder range, so its hash is its weighted sum rescaled to start at zero,
+# and a binder only has to fix up the tokens of the variables it binds.
+HASH_PRIME = (1 << 61) - 1
+HASH_BASE = key_hash("base", "") % HASH_PRIME
+HASH_BASE_INV = pow(HASH_BASE, -1, HASH_PRIME)
+TOKEN_APPLICATION = key_hash("token", "application") % HASH_PRIME
+TOKEN_ABSTRACTION = key_hash("token", "abstraction") % HASH_PRIME
+TOKEN_WILDCARD = key_hash("token", "_") % HASH_PRIME
+# Hashes are below 2**61 and these salts differ in their top bits, so sub and
+# pattern keys never coincide, without hashing every subterm again.
+SALT_SUB = key_hash("sub", "")
+SALT_PATTERN = key_hash("pattern", "")
+
+
+@functools.cache
+def name_token(name: str) -> int:
+    return key_hash("name", name) % HASH_PRIME
+
+
+@functools.cache
+def index_token(index: int) -> int:
+    return key_hash("index", str(index)) % HASH_PRIME
+
+
+# HASH_BASE ** i and its inverse, grown to the largest term seen so far.
+POWERS = [1]
+INVERSE_POWERS = [1]
+
+
+def grow_powers(n: int):
+    while len(POWERS) < n:
+        POWERS.append(POWERS[-1] * HASH_BASE % HASH_PRIME)
+        INVERSE_POWERS.append(INVERSE_POWERS[-1] * HASH_BASE_INV % HASH_PRIME)
+
+
+def scan_term(tree: ASTNode):
+    # One preorder and one post-order pass over `tree`. Returns the (sub key,
+    # pattern key) of every subterm in preorder, the variable names that
+    # occur and the free variables.
+    names, free = set(), set()
+    kinds, tokens, binders = [], [], []
+    stack = [(tree, {}, 0)]
+    while stack:
+        node, env, depth = stack.pop()
+        i = len(tokens)
+        if node.left is None and node.right is None:
+            token = name_token(node.value)
+            names.add(node.value)
+            binder = env.get(node.value)
+            if binder is None:
+                free.add(node.value)
+            else:
+                # Position of the binder and de Bruijn index of the variable.
+                binder = (binder[0], depth - binder[1] - 1)
+            kinds.append(NodeType.FreeVariable if binder is None else NodeType.BoundVariable)
+            tokens.append(token)
+            binders.append(binder)
+        elif node.left is None or node.right is None:
+            kinds.append(NodeType.Abstraction)
+            tokens.append(TOKEN_ABSTRACTION)
+            binders.append(None)
+            body = node.left if node.right is None else node.right
+            stack.append((body, {**env, node.value: (i, depth)}, depth + 1))
+        else:
+            kinds.append(NodeType.Application)
+            tokens.append(TOKEN_APPLICATION)
+            binders.append(None)
+            stack.append((node.right, env, depth))
+            stack.append((node.left, env, depth))
+
+    n = len(tokens)
+    grow_powers(n)
+    powers = POWERS
+
+    # Post-order pass, as reverse preorder. sums[i] and patterns[i] are the
+    # weighted token sums of subterm i and sizes[i] its number of nodes.
+    # bound[i] lists the variables abstraction i binds, as (position, de
+    # Bruijn index, name token).
+    sums, patterns, sizes = [0] * n, [0] * n, [1] * n
+    bound = {}
+    for i in range(n - 1, -1, -1):
+        kind, token = kinds[i], tokens[i]
+        if kind is NodeType.Application:
+            left, right = i + 1, i + 1 + sizes[i + 1]
+            weight = powers[i] * TOKEN_APPLICATION
+            sums[i] = (sums[left] + sums[right] + weight) % HASH_PRIME
+            patterns[i] = (patterns[left] + patterns[right] + weight) % HASH_PRIME
+            sizes[i] = sizes[left] + sizes[right] + 1
+        elif kind is NodeType.Abstraction:
+            weight = powers[i] * TOKEN_ABSTRACTION
+            sub, pattern = sums[i + 1] + weight, patterns[i + 1] + weight
+            for j, index, name in bound.pop(i, ()):
+                index = index_token(index)
+                sub += powers[j] * (index - name)
+                pattern += powers[j] * (index - TOKEN_WILDCARD)
+            sums[i], patterns[i] = sub % HASH_PRIME, pattern % HASH_PRIME
+            sizes[i] = sizes[i + 1] + 1
+        else:
+            sums[i] = powers[i] * token % HASH_PRIME
+            patterns[i] = powers[i] * TOKEN_WILDCARD % HASH_PRIME
+            if kind is NodeType.BoundVariable:
+                binder, index = binders[i]
+                bound.setdefault(binder, []).append((i, index, token))
+
+    keys = [(SALT_SUB ^ sub * inverse % HASH_PRIME, SALT_PATTERN ^ pattern * inverse % HASH_PRIME)
+            for sub, pattern, inverse in zip(sums, patterns, INVERSE_POWERS)]
+    return keys, names, free
+
+
+def term_keys(tree: ASTNode) -> np.ndarray:
+    subterm_keys, names, free = scan_term(tree)
+    keys = {key_hash("free", name) for name in free}
+    keys.update(key_hash("var", name) for name in names)
+    for sub, pattern in subterm_keys:
+        keys.add(sub)
+        keys.add(pattern)
+    return np.fromiter(keys, dtype=np.uint64, count=len(keys))
+
+
+def root_keys(tree: ASTNode) -> tuple[int, int]:
+    # (sub key, pattern key) of `tree` itself, for queries.
+    subterm_keys, _, _ = scan_term(tree)
+    return subterm_keys[0]
+
+
+def as_tree(term: ASTNode | str) -> ASTNode:
+    if isinstance(term, str):
+        return LambdaParser(LambdaLexer(term)).parse()
+    return term
+
+
+class IndexWriter:
+    def __init__(self, path: str, fmt: str, run_size: int = 1 << 22):
+        self.path = path
+        self.run_size = run_size
+        self.format = fmt
+        # Clear whatever an earlier index at this path left behind. meta.json
+        # is only written on close, so a partly written index cannot be
+        # opened either.
+        os.makedirs(path, exist_ok=True)
+        for stale in glob.glob(os.path.join(path, "segment-*.npy")) + [os.path.join(path, "meta.json")]:
+            if os.path.exists(stale):
+                os.remove(stale)
+        self.offsets = open(os.path.join(path, "offsets.bin"), "wb")
+        self.n_terms = 0
+        self.n_segments = 0
+        self.keys = []
+        self.term_ids = []
+        self.pending = 0
+
+    def add(self, term_id: int, offset: int, keys: np.ndarray):
+        # `offset` is the byte offset of the term's record in the corpus.
+        self.offsets.write(struct.pack("<q", offset))
+        self.n_terms += 1
+        self.keys.append(keys)
+        self.term_ids.append(np.full(len(keys), term_id, dtype=np.int64))
+        self.pending += len(keys)
+        if self.pending >= self.run_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        keys = np.concatenate(self.keys)
+        term_ids = np.concatenate(self.term_ids)
+        order = np.lexsort((term_ids, keys))
+        keys, term_ids = keys[order], term_ids[order]
+        unique, starts = np.unique(keys, return_index=True)
+        offsets = np.append(starts, len(keys)).astype(np.int64)
+
+        prefix = os.path.join(self.path, f"segment-{self.n_segments:05d}")
+        np.save(prefix + ".keys.npy", unique)
+        np.save(prefix + ".offsets.npy", offsets)
+        np.save(prefix + ".postings.npy", term_ids)
+        self.n_segments += 1
+        self.keys, self.term_ids, self.pending = [], [], 0
+
+    def close(self, corpus_size: int | None = None):
+        # `corpus_size` is the byte length of the finished corpus. Without it,
+        # e.g. when writing the corpus failed, no meta.json is written and
+        # the index cannot be opened.
+        self.flush()
+        self.offsets.close()
+        if corpus_size is None:
+            return
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"format": self.format, "n_terms": self.n_terms,
+                       "n_segments": self.n_segments, "corpus_size": corpus_size}, f)
+
+
+class CorpusIndex:
+    def __init__(self, corpus: str):
+        self.corpus = corpus
+        self.path = corpus + ".idx"
+        with open(os.path.join(self.path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["corpus_size"] != os.path.getsize(corpus):
+            raise ValueError(f"{self.path} was not built from the current {corpus}")
+        self.format = meta["format"]
+        # Only what meta.json lists belongs to this index.
+        n_terms = meta["n_terms"]
+        if n_terms:
+            offsets = os.path.join(self.path, "offsets.bin")
+            self.term_offsets = np.memmap(offsets, dtype="<i8", mode="r", shape=(n_terms,))
+        else:
+            self.term_offsets = np.empty(0, dtype="<i8")
+        self.segments = []
+        for segment in range(meta["n_segments"]):
+            prefix = os.path.join(self.path, f"segment-{segment:05d}")
+            self.segments.append(tuple(np.load(f"{prefix}.{part}.npy", mmap_mode="r")
+                                       for part in ("keys", "offsets", "postings")))
+
+    def __len__(self) -> int:
+        return len(self.term_offsets)
+
+    def lookup(self, key: int) -> np.ndarray:
+        # Sorted ids of the terms indexed under `key`. Segments hold
+        # increasing term ids, so concatenating keeps the result sorted.
+        found = []
+        for keys, offsets, postings in self.segments:
+            i = np.searchsorted(keys, np.uint64(key))
+            if i < len(keys) and keys[i] == key:
+                found.append(np.asarray(postings[offsets[i]:offsets[i + 1]]))
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def with_free_variable(self, name: str) -> np.ndarray:
+        return self.lookup(key_hash("free", name))
+
+    def with_variable(self, name: str) -> np.ndarray:
+        return self.lookup(key_hash("var", name))
+
+    def with_subterm(self, term: ASTNode | str) -> np.ndarray:
+        sub, _ = root_keys(as_tree(term))
+        return self.lookup(sub)
+
+    def with_pattern(self, term: ASTNode | str) -> np.ndarray:
+        _, pattern = root_keys(as_tree(term))
+        return self.lookup(pattern)
+
+    def terms(self, term_ids):
+        # Reads the given terms back from the corpus as lambda strings.
+        with open(self.corpus, "rb") as f:
+            for term_id in term_ids:
+                f.seek(self.term_offsets[term_id])
+                if self.format == "binary":
+                    (length,) = struct.unpack("<I", f.read(4))
+                    yield utils.decode_binary(f.read(length)).tolambda()
+                else:
+                    line = f.readline().decode().strip()
+                    yield line[len("eval "):-1] if self.format == "alchemy" else line
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a corpus written with cli.py --index.")
+    parser.add_argument("corpus")
+    parser.add_argument("--free", help="terms with this free variable")
+    parser.add_argument("--var", help="terms where this variable name occurs")
+    parser.add_argument("--subterm", help="terms with this subterm, up to renaming")
+    parser.add_argument("--pattern", help="terms with a subterm of this binder pattern")
+    parser.add_argument("--limit", type=int, default=10, help="number of matching terms to print")
+    args = parser.parse_args()
+
+    index = CorpusIndex(args.corpus)
+    matches = None
+    for query, value in ((index.with_free_variable, args.free),
+                         (index.with_variable, args.var),
+                         (index.with_subterm, args.subterm),
+                         (index.with_pattern, args.pattern)):
+        if value is not None:
+            ids = query(value)
+            matches = ids if matches is None else np.intersect1d(matches, ids)
+    if matches is None:
+        parser.error("no query given")
+
+    print(f"{len(matches)} of {len(index)} terms match")
+    for term in index.terms(matches[:args.limit]):
+        print(term)
+
+
+if __name__ == "__main__":
+    main()
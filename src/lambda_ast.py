@@ -194,6 +194,32 @@ class ASTNode:
                 return self.right.search_for_value(value) \
                        or self.left.search_for_value(value)
 
+    def n_nodes(self):
+        match self.left, self.right:
+            case (None, None):
+                return 1
+            case (None, _):
+                return self.right.n_nodes() + 1
+            case (_, None):
+                return self.left.n_nodes() + 1
+            case (_, _):
+                return self.right.n_nodes() + self.left.n_nodes() + 1
+
+    def free_variables(self, bound=frozenset()):
+        match self.left, self.right:
+            case (None, None):
+                return set() if self.value in bound else {self.value}
+            case (None, _):
+                return self.right.free_variables(bound | {self.value})
+            case (_, None):
+                return self.left.free_variables(bound | {self.value})
+            case (_, _):
+                return self.left.free_variables(bound) \
+                    | self.right.free_variables(bound)
+
+    def is_closed(self):
+        return not self.free_variables()
+
 
 
 class AST:
@@ -1,10 +1,8 @@
 from __future__ import annotations
 import re
 
-from src.lambda_ast import ASTNode
-from src.lambda_token import Token, TokenType
-
-from ete3 import Tree, TreeStyle
+from lambda_ast import ASTNode
+from lambda_token import Token, TokenType
 
 
 class LambdaLexer:
@@ -117,6 +115,8 @@ class LambdaParser:
 
 
 def main():
+    from ete3 import TreeStyle
+
     lexer = LambdaLexer(r"\ x . \ y . x y (x y)")
     parser = LambdaParser(lexer)
     ast = parser.parse()
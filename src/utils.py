@@ -1,10 +1,74 @@
+import struct
+
+from lambda_ast import ASTNode
+
+# Binary corpus layout: a 4-byte magic header, then one record per term. A
+# record is a little-endian u32 payload length followed by the term in
+# prefix order, one tag byte per node. Abstractions and variables carry their
+# name as a length byte followed by ascii.
+BINARY_MAGIC = b"LBT1"
+TAG_APPLICATION = 0
+TAG_ABSTRACTION = 1
+TAG_VARIABLE = 2
+
+
 def dump_gen_in_alchemy_fmt(gen, n):
     print("1\n")
-    for i in range(n):
-        s = gen.random_lambda()
+    for s in gen.iter_lambdas(stop=n):
         s = "eval " + s + ";"
         print(s)
 
 def dump_gen(gen, n):
-    for i in range(n):
-        print(gen.random_lambda())
+    for s in gen.iter_lambdas(stop=n):
+        print(s)
+
+
+def to_alchemy(s: str) -> str:
+    return "eval " + s + ";"
+
+
+def encode_binary(tree: ASTNode) -> bytes:
+    out = bytearray()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        match node.left, node.right:
+            case (None, None):
+                name = node.value.encode("ascii")
+                out += bytes((TAG_VARIABLE, len(name))) + name
+            case (None, body) | (body, None):
+                name = node.value.encode("ascii")
+                out += bytes((TAG_ABSTRACTION, len(name))) + name
+                stack.append(body)
+            case (left, right):
+                out.append(TAG_APPLICATION)
+                stack.append(right)
+                stack.append(left)
+    return struct.pack("<I", len(out)) + bytes(out)
+
+
+def decode_binary(payload: bytes) -> ASTNode:
+    def decode(pos):
+        tag = payload[pos]
+        if tag == TAG_APPLICATION:
+            left, pos = decode(pos + 1)
+            right, pos = decode(pos)
+            return ASTNode(left, right), pos
+        length = payload[pos + 1]
+        name = payload[pos + 2:pos + 2 + length].decode("ascii")
+        pos += 2 + length
+        if tag == TAG_ABSTRACTION:
+            body, pos = decode(pos)
+            return ASTNode(body, None).set_value(name), pos
+        return ASTNode(None, None).set_value(name), pos
+
+    tree, _ = decode(0)
+    return tree
+
+
+def read_binary(f):
+    if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+        raise ValueError("not a binary lambda corpus")
+    while header := f.read(4):
+        (length,) = struct.unpack("<I", header)
+        yield decode_binary(f.read(length))